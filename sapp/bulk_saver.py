@@ -6,16 +6,29 @@
 """Bulk saving objects for performance
 """
 
+import csv
+import io
 import logging
-from typing import Any, Callable, Dict, Optional
+import sys
+import time
+from concurrent.futures import Future, ThreadPoolExecutor
+from typing import Any, Callable, Dict, Iterable, List, Optional, Set, Tuple, Type
 
+from sqlalchemy import func, select, tuple_
+from sqlalchemy.dialects.mysql import insert as mysql_insert
+from sqlalchemy.dialects.postgresql import insert as postgresql_insert
 from sqlalchemy.exc import IntegrityError
+from sqlalchemy.orm import Session
+from sqlalchemy.pool import QueuePool
+from sqlalchemy.sql.expression import Insert
 
 from .db import DB
+from .db_support import column_keys
 from .decorators import log_time
-from .iterutil import split_every
+from .iterutil import drain_every
 from .models import (
     ClassTypeInterval,
+    DBID,
     Issue,
     IssueInstance,
     IssueInstanceFixInfo,
@@ -33,6 +46,118 @@ from .models import (
 log: logging.Logger = logging.getLogger("sapp")
 
 
+def _group_by_columns(
+    cls: Type[Any], rows: List[Dict[str, Any]]
+) -> Iterable[List[Dict[str, Any]]]:
+    """Group rows by the columns they bind. A bulk insert statement has to bind
+    the same columns for every row, e.g. to leave out the ones with defaults."""
+    if cls.uniform_keys and not cls.sparse_nulls:
+        return [rows]
+    groups: Dict[Tuple[str, ...], List[Dict[str, Any]]] = {}
+    for row in rows:
+        groups.setdefault(tuple(row), []).append(row)
+    return groups.values()
+
+
+def _drop_repeated_records(cls: Type[Any], batch: List[Any]) -> List[Any]:
+    """Drop the records of a batch whose rows repeat an earlier row, judging by
+    `cls.unique_key`. Generated primary keys outside of the key can't tell such
+    rows apart, so they are ignored. Rows that share a key but differ otherwise
+    are kept, so the insert fails for them rather than silently losing data."""
+    generated = {column.key for column in cls.__table__.primary_key} - set(
+        cls.unique_key
+    )
+    seen: Dict[Tuple[Any, ...], Dict[str, Any]] = {}
+    kept = []
+    for record, row in zip(batch, cls.to_rows(batch)):
+        # DBIDs only compare equal to themselves, so compare what they resolve to
+        values = {
+            column: value.resolved() if isinstance(value, DBID) else value
+            for column, value in row.items()
+            if column not in generated
+        }
+        key = tuple(values[column] for column in cls.unique_key)
+        if seen.setdefault(key, values) is not values and seen[key] == values:
+            continue
+        kept.append(record)
+    return kept
+
+
+def _copy_csv(cls: Type[Any], batch: List[Any]) -> Tuple[List[str], io.StringIO]:
+    """The column keys of `cls` and a CSV of `batch` for COPY to load into them.
+    Every column is written for every row, whatever columns the row binds."""
+    keys = list(column_keys(cls).values())
+    buffer = io.StringIO()
+    writer = csv.writer(buffer)
+    for row in cls.to_rows(batch):
+        # An unquoted empty field is NULL in the CSV format
+        values = (row.get(key) for key in keys)
+        writer.writerow(["" if value is None else int(value) for value in values])
+    buffer.seek(0)
+    return keys, buffer
+
+
+def _skipping_duplicates_insert(cls: Type[Any], dialect: str) -> Optional[Insert]:
+    """An insert into `cls`'s table that skips rows with duplicate keys, and
+    nothing else, or None if `dialect` has none. (MySQL's INSERT IGNORE would
+    also store coerced values in place of invalid ones.)"""
+    table = cls.__table__
+    if dialect == "postgresql":
+        return postgresql_insert(table).on_conflict_do_nothing()
+    if dialect == "mysql":
+        # Setting a column to itself leaves the existing row as it is
+        key = next(iter(table.primary_key))
+        return mysql_insert(table).on_duplicate_key_update([(key.name, key)])
+    return None
+
+
+def _count_present_rows(
+    session: Session, cls: Type[Any], rows: List[Dict[str, Any]]
+) -> int:
+    """How many of `rows` have a primary key that is in `cls`'s table, as
+    `session` sees it."""
+    table = cls.__table__
+    columns = list(table.primary_key)
+    keys = [tuple(row[column.key] for column in columns) for row in rows]
+    query = select([func.count()]).select_from(table)
+    return session.execute(query.where(tuple_(*columns).in_(keys))).scalar()
+
+
+def _supports_copy(database: DB) -> bool:
+    dialect = database.engine.dialect
+    return dialect.name == "postgresql" and dialect.driver == "psycopg2"
+
+
+class _AdaptiveBatchSize:
+    """Steers the size of the batches of one class toward the best throughput:
+    grow the batches while rows per second improve, shrink them when it drops.
+    The best size depends on the latency to the database and the row width."""
+
+    GROWTH = 1.5
+    SHRINKAGE = 0.5
+
+    def __init__(self, initial: int, minimum: int, maximum: int) -> None:
+        self.minimum: int = min(minimum, maximum)
+        self.maximum = maximum
+        self.size: int = max(self.minimum, min(initial, maximum))
+        self.rows_per_second: Optional[float] = None
+
+    def record(self, rows: int, seconds: float) -> None:
+        rows_per_second = rows / max(seconds, 1e-9)
+        previous = self.rows_per_second
+        self.rows_per_second = rows_per_second
+        if previous is None or rows < self.size:
+            # Nothing to compare to yet, or a short last batch
+            return
+        if rows_per_second > previous:
+            factor = self.GROWTH
+        elif rows_per_second < previous:
+            factor = self.SHRINKAGE
+        else:
+            return
+        self.size = max(self.minimum, min(int(self.size * factor), self.maximum))
+
+
 class BulkSaver:
     """Stores new objects created within a run and bulk save them"""
 
@@ -52,8 +177,68 @@ class BulkSaver:
         MetaRunIssueInstanceIndex,
     ]
 
+    # The classes whose ids each class's records refer to. Saving a class can
+    # re-merge its duplicates and change their ids (see `_save_batch`), so a
+    # class is only saved once everything it refers to has been saved. Classes
+    # without dependencies between them are saved concurrently.
+    SAVING_CLASSES_DEPENDENCIES: Dict[Type[Any], List[Type[Any]]] = {
+        SharedText: [],
+        Issue: [SharedText],
+        IssueInstanceFixInfo: [],
+        IssueInstance: [SharedText, Issue, IssueInstanceFixInfo],
+        IssueInstanceSharedTextAssoc: [IssueInstance, SharedText],
+        TraceFrame: [SharedText],
+        IssueInstanceTraceFrameAssoc: [IssueInstance, TraceFrame],
+        TraceFrameAnnotation: [SharedText, TraceFrame],
+        TraceFrameLeafAssoc: [TraceFrame, SharedText],
+        TraceFrameAnnotationTraceFrameAssoc: [TraceFrameAnnotation, TraceFrame],
+        ClassTypeInterval: [],
+        MetaRunIssueInstanceIndex: [IssueInstance],
+    }
+
+    # Classes whose ids are only known once a later class has been prepared.
+    # `Issue.first_instance_id` is resolved when preparing `IssueInstance`.
+    SAVING_CLASSES_PREPARED_BEFORE: Dict[Type[Any], List[Type[Any]]] = {
+        Issue: [IssueInstance],
+    }
+
+    # Classes that can be bulk loaded with PostgreSQL's COPY, which skips parsing
+    # an INSERT statement. These association tables are the largest ones, and
+    # only have integer columns without server-side defaults.
+    COPY_CLASSES: Set[Type[Any]] = {
+        IssueInstanceSharedTextAssoc,
+        IssueInstanceTraceFrameAssoc,
+        TraceFrameLeafAssoc,
+        TraceFrameAnnotationTraceFrameAssoc,
+    }
+
     BATCH_SIZE = 30000
 
+    # Batches of a class start at this size and are grown or shrunk (down to
+    # MIN_BATCH_SIZE, up to BATCH_SIZE) depending on the throughput
+    INITIAL_BATCH_SIZE = 4000
+    MIN_BATCH_SIZE = 500
+
+    # Classes with fewer records than this are prepared without a log line
+    LOG_PREPARE_MIN_ITEMS = 1000
+
+    # How many batches to insert per transaction when saving a class
+    COMMIT_EVERY_N_BATCHES = 1
+
+    # Roughly how many bind parameters a single statement can carry on each
+    # dialect. This only limits the multi-row VALUES statements that skip
+    # duplicates: the executemany inserts bind one row per execution.
+    MAX_PARAMETERS: Dict[str, int] = {
+        "mssql": 2000,
+        "sqlite": 30000,
+        "postgresql": 30000,
+        "mysql": 60000,
+    }
+
+    # Upper bound on the (estimated) in-memory size of a batch, so that batches
+    # of wide rows don't outgrow the packets the server accepts.
+    MAX_BATCH_BYTES: int = 64 * 1024 * 1024
+
     # The number of sub-batches to split the parent batch into before retrying
     # on duplicate key exceptions.
     #
@@ -68,42 +253,71 @@ class BulkSaver:
     BATCH_SPLIT_FACTOR = 4
 
     def __init__(
-        self, primary_key_generator: Optional[PrimaryKeyGenerator] = None
+        self,
+        primary_key_generator: Optional[PrimaryKeyGenerator] = None,
+        batch_size: int = BATCH_SIZE,
+        initial_batch_size: int = INITIAL_BATCH_SIZE,
+        min_batch_size: int = MIN_BATCH_SIZE,
+        batch_split_factor: int = BATCH_SPLIT_FACTOR,
+        max_batch_bytes: int = MAX_BATCH_BYTES,
+        commit_every_n_batches: int = COMMIT_EVERY_N_BATCHES,
     ) -> None:
+        """The batch parameters can be tuned to the database connection, e.g. a
+        remote database usually does better with larger batches than a local one.
+        """
         self.primary_key_generator: PrimaryKeyGenerator = (
             primary_key_generator or PrimaryKeyGenerator()
         )
-        self.saving: Dict[str, Any] = {}
+        assert batch_size >= 1, f"Cannot save in batches of {batch_size}"
+        # Splitting in fewer than 2 would retry the same batch forever
+        assert (
+            batch_split_factor >= 2
+        ), f"Cannot split batches by a factor of {batch_split_factor}"
+        self.batch_size = batch_size
+        self.initial_batch_size = initial_batch_size
+        self.min_batch_size = min_batch_size
+        self.batch_split_factor = batch_split_factor
+        self.max_batch_bytes = max_batch_bytes
+        self.commit_every_n_batches = commit_every_n_batches
+        self.saving: Dict[Type[Any], List[Any]] = {}
+        # Bound `append` of each list in `saving`, for the hot `add_*` helpers
+        self._appenders: Dict[Type[Any], Callable[[Any], None]] = {}
         for cls in self.SAVING_CLASSES_ORDER:
-            self.saving[cls.__name__] = []
+            self._set_items(cls, [])
 
     # pyre-fixme[2]: Parameter must be annotated.
     def add(self, item) -> None:
-        assert item.model in self.SAVING_CLASSES_ORDER, (
+        assert item.model in self.saving, (
             "%s should be added with session.add()" % item.model.__name__
         )
-        self.saving[item.model.__name__].append(item)
+        self._appenders[item.model](item)
 
     # pyre-fixme[2]: Parameter must be annotated.
     def add_all(self, items) -> None:
         if items:
-            assert items[0].model in self.SAVING_CLASSES_ORDER, (
+            assert items[0].model in self.saving, (
                 "%s should be added with session.add_all()" % items[0].model.__name__
             )
-            self.saving[items[0].model.__name__].extend(items)
+            self.saving[items[0].model].extend(items)
+
+    def add_typed(self, cls: Type[Any], item: Any) -> None:
+        """Like `add`, for callers that already know the item's model"""
+        self._appenders[cls](item)
+
+    def _set_items(self, cls: Type[Any], items: List[Any]) -> None:
+        self.saving[cls] = items
+        self._appenders[cls] = items.append
 
     # pyre-fixme[3]: Return type must be annotated.
     # pyre-fixme[2]: Parameter must be annotated.
     def get_items_to_add(self, cls):
-        return self.saving[cls.__name__]
+        return self.saving[cls]
 
     def save_all(
         self, database: DB, before_save: Optional[Callable[[], None]] = None
     ) -> None:
         saving_classes = [
-            cls
-            for cls in self.SAVING_CLASSES_ORDER
-            if len(self.saving[cls.__name__]) != 0
+            cls for cls in self.SAVING_CLASSES_ORDER if len(self.saving[cls]) != 0
         ]
 
         item_counts = {
@@ -115,47 +329,297 @@ class BulkSaver:
                 session, saving_classes, item_counts
             )
 
+        workers = self._save_workers(database, len(saving_classes))
+        if workers > 1:
+            self._prepare_and_save_pipelined(
+                database, saving_classes, pk_gen, workers, before_save
+            )
+            return
+
         for cls in saving_classes:
-            log.info("Merging and generating ids for %s...", cls.__name__)
+            self._log_prepare(cls)
             self._prepare(database, cls, pk_gen)
 
         # Used by unit tests to simulate races
         if before_save:
             before_save()
 
+        small = self._small_classes(saving_classes)
         for cls in saving_classes:
-            log.info("Saving %s...", cls.__name__)
-            self._save(database, cls, pk_gen)
+            if cls not in small:
+                self._save_classes(database, [cls], pk_gen)
+        if small:
+            self._save_classes(database, small, pk_gen)
+
+    def _small_classes(self, saving_classes: List[Type[Any]]) -> List[Type[Any]]:
+        """The classes with fewer records than a batch that no larger class
+        depends on, directly or through other classes, in saving order. These
+        are saved last, in a single transaction rather than a transaction each.
+        A single class gains nothing from that, so it isn't returned alone."""
+        small: List[Type[Any]] = []
+        # Dependents come later in the saving order, so are decided first
+        for cls in reversed(saving_classes):
+            if len(self.saving[cls]) < self.batch_size and all(
+                dependent in small
+                for dependent in saving_classes
+                if cls in self.SAVING_CLASSES_DEPENDENCIES[dependent]
+            ):
+                small.append(cls)
+        small.reverse()
+        return small if len(small) > 1 else []
+
+    def _save_classes(
+        self,
+        database: DB,
+        classes: List[Type[Any]],
+        pk_gen: PrimaryKeyGenerator,
+    ) -> None:
+        log.info("Saving %s...", ", ".join(cls.__name__ for cls in classes))
+        if len(classes) == 1:
+            self._save(database, classes[0], pk_gen)
+        else:
+            self._save_together(database, classes, pk_gen)
+
+    def _save_together(
+        self,
+        database: DB,
+        classes: List[Type[Any]],
+        pk_gen: PrimaryKeyGenerator,
+    ) -> None:
+        """Save `classes`, in order, with a single commit. Should any of them hit
+        a duplicate key, everything is rolled back and the classes are saved one
+        by one with `_save`, which knows how to deal with duplicates."""
+        with database.make_session() as session:
+            try:
+                for cls in classes:
+                    self._save_no_commit(session, cls)
+                session.commit()
+            except IntegrityError:
+                session.rollback()
+                for cls in classes:
+                    self._save(database, cls, pk_gen)
+                return
+        for cls in classes:
+            self._set_items(cls, [])
+
+    def _save_no_commit(self, session: Session, cls: Type[Any]) -> None:
+        items = self.saving[cls]
+        if not items:
+            return
+        if cls.unique_key:
+            items = _drop_repeated_records(cls, items)
+        batch_size = self._effective_batch_size(cls, items[0])
+        # Items stay in `saving` until committed, in case of a fallback to `_save`
+        for start in range(0, len(items), batch_size):
+            self._insert_batch(session, cls, items[start : start + batch_size])
+
+    def _log_prepare(self, cls: Type[Any]) -> None:
+        if len(self.saving[cls]) >= self.LOG_PREPARE_MIN_ITEMS:
+            log.info("Merging and generating ids for %s...", cls.__name__)
+
+    def _prepare_and_save_pipelined(
+        self,
+        database: DB,
+        saving_classes: List[Type[Any]],
+        pk_gen: PrimaryKeyGenerator,
+        workers: int,
+        before_save: Optional[Callable[[], None]] = None,
+    ) -> None:
+        """Prepare classes in order, saving each one in the background as soon as
+        it is prepared, so merging the next class overlaps with the inserts.
+        Classes without dependencies between them are saved concurrently, and the
+        small classes (see `_small_classes`) together once their dependencies
+        are saved. With `before_save`, nothing is saved until every class has
+        been prepared and it has been called."""
+        small = self._small_classes(saving_classes)
+        futures: Dict[Type[Any], "Future[None]"] = {}
+        prepared = set()
+        pending: List[Type[Any]] = []
+        with ThreadPoolExecutor(max_workers=workers) as executor:
+
+            def submit_ready() -> None:
+                # Submit in order, so that every save is queued after the saves
+                # it waits for and workers can never all be blocked.
+                while pending and all(
+                    later in prepared or later not in saving_classes
+                    for later in self.SAVING_CLASSES_PREPARED_BEFORE.get(pending[0], [])
+                ):
+                    ready = pending.pop(0)
+                    if ready not in small:
+                        futures[ready] = executor.submit(
+                            self._save_after,
+                            self._dependencies(futures, [ready]),
+                            database,
+                            [ready],
+                            pk_gen,
+                        )
+
+            for cls in saving_classes:
+                self._log_prepare(cls)
+                self._prepare(database, cls, pk_gen)
+                prepared.add(cls)
+                pending.append(cls)
+                if before_save is None:
+                    submit_ready()
+
+            # Used by unit tests to simulate races
+            if before_save:
+                before_save()
+            submit_ready()
+
+            # No other class depends on the small ones, so they can go last
+            small_future = (
+                executor.submit(
+                    self._save_after,
+                    self._dependencies(futures, small),
+                    database,
+                    small,
+                    pk_gen,
+                )
+                if small
+                else None
+            )
+
+            for future in futures.values():
+                future.result()
+            if small_future:
+                small_future.result()
+
+    def _dependencies(
+        self, futures: Dict[Type[Any], "Future[None]"], classes: List[Type[Any]]
+    ) -> List["Future[None]"]:
+        """The saves that saving `classes` has to wait for"""
+        return [
+            futures[parent]
+            for cls in classes
+            for parent in self.SAVING_CLASSES_DEPENDENCIES[cls]
+            if parent in futures
+        ]
+
+    def _save_after(
+        self,
+        dependencies: List["Future[None]"],
+        database: DB,
+        classes: List[Type[Any]],
+        pk_gen: PrimaryKeyGenerator,
+    ) -> None:
+        for dependency in dependencies:
+            dependency.result()
+        self._save_classes(database, classes, pk_gen)
+
+    def _save_workers(self, database: DB, class_count: int) -> int:
+        # SQLite serializes writers anyway, and every thread would get its own
+        # connection to a separate in-memory database.
+        if database.engine.dialect.name == "sqlite":
+            return 1
+        pool = database.engine.pool
+        pool_size = pool.size() if isinstance(pool, QueuePool) else 1
+        return max(1, min(class_count, pool_size))
 
     @log_time
     # pyre-fixme[2]: Parameter must be annotated.
     def _prepare(self, database: DB, cls, pk_gen: PrimaryKeyGenerator) -> None:
-        # We sort keys because bulk insert uses executemany, but it can only
-        # group together sequential items with the same keys. If we are scattered
-        # then it does far more executemany calls, and it kills performance.
-        items = sorted(
-            cls.prepare(database, pk_gen, self.saving[cls.__name__]),
-            key=lambda r: list(cls.to_dict(r).keys()),
-        )
-        self.saving[cls.__name__] = items
+        self._set_items(cls, cls.prepare(database, pk_gen, self.saving[cls]))
 
     @log_time
     # pyre-fixme[2]: Parameter must be annotated.
     def _save(self, database: DB, cls, pk_gen: PrimaryKeyGenerator) -> None:
-        items = self.saving[cls.__name__]
-        self.saving[cls.__name__] = []  # allow GC after we are done
+        items = self.saving[cls]
+        self._set_items(cls, [])
 
-        # bulk_insert_mappings should only be used for new objects.
+        # Bulk inserts should only be used for new objects.
         # To update an existing object, just modify its attribute(s)
         # and call session.commit()
-        for batch in split_every(self.BATCH_SIZE, items):
-            round_trips = self._save_batch(database, cls, batch)
-            if round_trips > 1:
+        #
+        # Batches are taken out of `items` as we go, so each one can be garbage
+        # collected once it is saved rather than when the whole class is done.
+        if not items:
+            return
+        batch_size = _AdaptiveBatchSize(
+            self.initial_batch_size,
+            self.min_batch_size,
+            self._effective_batch_size(cls, items[0]),
+        )
+        copy = cls in self.COPY_CLASSES and _supports_copy(database)
+        duplicate_errors = (IntegrityError,)
+        if copy:
+            # COPY goes through the DBAPI cursor, so its errors aren't wrapped
+            duplicate_errors += (database.engine.dialect.dbapi.IntegrityError,)
+
+        # All batches share a session, committing every few batches. Should a
+        # batch hit a duplicate key, the batches since the last commit are
+        # rolled back and saved one by one with `_save_batch`, which knows how
+        # to deal with duplicates.
+        uncommitted = []
+        with database.make_session() as session:
+            for batch in drain_every(lambda: batch_size.size, items):
+                # Timed against the rows taken, which dropping repeats doesn't
+                # change, or the batch would look like a short last one
+                rows = len(batch)
+                if cls.unique_key:
+                    batch = _drop_repeated_records(cls, batch)
+                uncommitted.append(batch)
+                start = time.perf_counter()
+                try:
+                    if copy:
+                        self._copy_batch(session, cls, batch)
+                    else:
+                        self._insert_batch(session, cls, batch)
+                    if len(uncommitted) >= self.commit_every_n_batches:
+                        session.commit()
+                        uncommitted = []
+                    batch_size.record(rows, time.perf_counter() - start)
+                except duplicate_errors:
+                    session.rollback()
+                    self._save_batches(database, cls, uncommitted)
+                    uncommitted = []
+            try:
+                session.commit()
+            except IntegrityError:
+                session.rollback()
+                self._save_batches(database, cls, uncommitted)
+
+    def _save_batches(
+        self, database: DB, cls: Type[Any], batches: List[List[Any]]
+    ) -> None:
+        for batch in batches:
+            # Count the attempt that was rolled back
+            round_trips = 1 + self._save_batch(database, cls, batch)
+            if log.isEnabledFor(logging.INFO):
                 log.info(
                     f"Saving {cls.__name__} batch of {len(batch)} "
                     f"took {round_trips} round trips due to duplicate key retries"
                 )
 
+    def _insert_batch(self, session: Session, cls: Type[Any], batch: List[Any]) -> None:
+        # A Core executemany skips the ORM unit of work and lets the driver send
+        # each group of rows in as few statements as it can.
+        for group in _group_by_columns(cls, cls.to_rows(batch)):
+            session.execute(cls.__table__.insert(), group)
+
+    def _copy_batch(self, session: Session, cls: Type[Any], batch: List[Any]) -> None:
+        """Insert a batch with COPY ... FROM STDIN"""
+        keys, buffer = _copy_csv(cls, batch)
+        preparer = session.bind.dialect.identifier_preparer
+        table = cls.__table__
+        columns = ", ".join(preparer.quote(table.c[key].name) for key in keys)
+        cursor = session.connection().connection.cursor()
+        try:
+            cursor.copy_expert(
+                f"COPY {preparer.format_table(table)} ({columns}) "
+                "FROM STDIN WITH (FORMAT csv)",
+                buffer,
+            )
+        finally:
+            cursor.close()
+
+    def _effective_batch_size(self, cls: Type[Any], sample: Any) -> int:
+        """The batch size for saving `cls`, limited by `max_batch_bytes`.
+        `sample` is a record whose size is taken as representative."""
+        row = cls.to_rows([sample])[0]
+        row_bytes = sys.getsizeof(row) + sum(sys.getsizeof(v) for v in row.values())
+        return max(1, min(self.batch_size, self.max_batch_bytes // row_bytes))
+
     # Save a batch of records to the database, handling duplicate key errors
     # by retrying in smaller batches until all non-duplicate records have been
     # inserted and all duplicates have been merged with existing rows.
@@ -164,14 +628,14 @@ class BulkSaver:
     # There is a race where another script can insert a duplicate after `_prepare` but
     # before `_save`.
     #
+    # This runs for every retried batch, so unlike `_save` it isn't `@log_time`d.
+    #
     # pyre-fixme[2]: Parameter must be annotated.
     def _save_batch(self, database: DB, cls, batch) -> int:
         round_trips = 1
         try:
             with database.make_session() as session:
-                session.bulk_insert_mappings(
-                    cls, (cls.to_dict(r) for r in batch), render_nulls=True
-                )
+                self._insert_batch(session, cls, batch)
                 session.commit()
             return round_trips
         # "Duplicate entry for key" errors are surfaced as IntegrityError
@@ -190,41 +654,90 @@ class BulkSaver:
                         f"Got a duplicate key exception that was not resolved "
                         f"by {cls.__name__}.merge: {duplicate}"
                     ) from e
+            elif self._save_batch_skipping_duplicates(database, cls, batch):
+                round_trips += 1
             else:
                 # The batch contained multiple items, so we don't which record
                 # caused the failure. Split into smaller "sub_batches" and retry.
                 #
                 # Negations are ceiling integer division to avoid batch size of 0
-                sub_batch_size = -(len(batch) // -self.BATCH_SPLIT_FACTOR)
-                for sub_batch in split_every(sub_batch_size, batch):
-                    round_trips += self._save_batch(database, cls, sub_batch)
+                sub_batch_size = -(len(batch) // -self.batch_split_factor)
+                for start in range(0, len(batch), sub_batch_size):
+                    round_trips += self._save_batch(
+                        database, cls, batch[start : start + sub_batch_size]
+                    )
             return round_trips
 
+    # Insert the rows of a batch that don't clash with existing rows in a single
+    # statement, then merge the rest. This avoids isolating the duplicates one
+    # split at a time, but is only possible where the dialect has an insert that
+    # skips duplicate keys.
+    #
+    # Returns False, with nothing saved, if the batch has to be retried in
+    # smaller batches instead.
+    def _save_batch_skipping_duplicates(
+        self, database: DB, cls: Type[Any], batch: List[Any]
+    ) -> bool:
+        dialect = database.engine.dialect.name
+        statement = _skipping_duplicates_insert(cls, dialect)
+        if statement is None:
+            return False
+
+        # Each statement binds every column of each of its rows
+        rows_per_statement = max(
+            1, self.MAX_PARAMETERS[dialect] // len(cls.__table__.columns)
+        )
+        with database.make_session() as session:
+            inserted = 0
+            for group in _group_by_columns(cls, cls.to_rows(batch)):
+                for start in range(0, len(group), rows_per_statement):
+                    rows = group[start : start + rows_per_statement]
+                    result = session.execute(statement.values(rows))
+                    if dialect == "mysql":
+                        # MySQL counts a row that hit a duplicate key as affected
+                        # too (SQLAlchemy always sets CLIENT_FOUND_ROWS), so count
+                        # the rows that are there instead, before merge can
+                        # change ids
+                        inserted += _count_present_rows(session, cls, rows)
+                    else:
+                        inserted += result.rowcount
+            # Our rows aren't visible to other sessions until we commit, so merge
+            # only resolves the records that clashed with existing rows. Anything
+            # else it returns was skipped for a reason merge can't fix.
+            if len(list(cls.merge(database, batch))) != inserted:
+                session.rollback()
+                return False
+            session.commit()
+        return True
+
     def add_trace_frame_leaf_assoc(
         self, message: SharedText, trace_frame: TraceFrame, depth: Optional[int]
     ) -> None:
-        self.add(
+        self.add_typed(
+            TraceFrameLeafAssoc,
             TraceFrameLeafAssoc.Record(
                 trace_frame_id=trace_frame.id, leaf_id=message.id, trace_length=depth
-            )
+            ),
         )
 
     def add_issue_instance_trace_frame_assoc(
         self, issue_instance: IssueInstance, trace_frame: TraceFrame
     ) -> None:
-        self.add(
+        self.add_typed(
+            IssueInstanceTraceFrameAssoc,
             IssueInstanceTraceFrameAssoc.Record(
                 issue_instance_id=issue_instance.id, trace_frame_id=trace_frame.id
-            )
+            ),
         )
 
     def add_issue_instance_shared_text_assoc(
         self, issue_instance: IssueInstance, shared_text: SharedText
     ) -> None:
-        self.add(
+        self.add_typed(
+            IssueInstanceSharedTextAssoc,
             IssueInstanceSharedTextAssoc.Record(
                 issue_instance_id=issue_instance.id, shared_text_id=shared_text.id
-            )
+            ),
         )
 
     def add_trace_frame_annotation_trace_frame_assoc(
@@ -232,15 +745,16 @@ class BulkSaver:
         trace_frame_annotation: TraceFrameAnnotation,
         trace_frame: TraceFrame,
     ) -> None:
-        self.add(
+        self.add_typed(
+            TraceFrameAnnotationTraceFrameAssoc,
             TraceFrameAnnotationTraceFrameAssoc.Record(
                 trace_frame_annotation_id=trace_frame_annotation.id,
                 trace_frame_id=trace_frame.id,
-            )
+            ),
         )
 
     def dump_stats(self) -> str:
         stat_str = ""
         for cls in self.SAVING_CLASSES_ORDER:
-            stat_str += "%s: %d\n" % (cls.__name__, len(self.saving[cls.__name__]))
+            stat_str += "%s: %d\n" % (cls.__name__, len(self.saving[cls]))
         return stat_str
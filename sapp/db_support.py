@@ -5,10 +5,23 @@
 
 from __future__ import annotations
 
+import functools
 import logging
 from collections import namedtuple
 from itertools import tee
-from typing import Dict, Iterable, Iterator, List, Optional, Set, Tuple, Type, Union
+from typing import (
+    Any,
+    Callable,
+    Dict,
+    FrozenSet,
+    Iterable,
+    List,
+    Optional,
+    Set,
+    Tuple,
+    Type,
+    Union,
+)
 
 from munch import Munch
 from sqlalchemy import and_, Column, exc, inspect, or_, String, types
@@ -157,15 +170,16 @@ class PrepareMixin:
         database: DB,
         pkgen: PrimaryKeyGeneratorBase,
         items: Iterable[PrepareMixin],
-    ) -> Iterator[PrepareMixin]:
+    ) -> List[PrepareMixin]:
         """This is called immediately before the items are written to the
         database. pkgen is passed in to allow last-minute resolving of ids.
         """
-        for item in cls.merge(database, items):
-            if hasattr(item, "id"):
+        merged = list(cls.merge(database, items))
+        if merged and hasattr(merged[0], "id"):
+            for item, id in zip(merged, pkgen.assign_range(cls, len(merged))):
                 # pyre-fixme[16]: `PrepareMixin` has no attribute `id` (we checked)
-                item.id.resolve(id=pkgen.get(cls), is_new=True)
-            yield item
+                item.id.resolve(id=id, is_new=True)
+        return merged
 
     @classmethod
     def merge(
@@ -275,6 +289,67 @@ class PrepareMixin:
                 yield i
 
 
+@functools.lru_cache(maxsize=None)
+def column_keys(cls: Type[Any]) -> Dict[str, str]:
+    """Map from a model's attribute names to the keys of its table columns, in
+    mapper order. They differ for legacy columns, e.g. `TraceFrameLeafAssoc.leaf_id`
+    is stored in `message_id`."""
+    return {attr.key: attr.columns[0].key for attr in inspect(cls).column_attrs}
+
+
+@functools.lru_cache(maxsize=None)
+def sparse_null_columns(cls: Type[Any]) -> FrozenSet[str]:
+    """Keys of the columns that a None value can be left out for without
+    changing the result: nullable columns without defaults are NULL either way,
+    and non-nullable columns with defaults would reject the NULL."""
+    columns = set()
+    for attr in inspect(cls).column_attrs:
+        column = attr.columns[0]
+        has_default = column.default is not None or column.server_default is not None
+        if column.nullable != has_default:
+            columns.add(column.key)
+    return frozenset(columns)
+
+
+@functools.lru_cache(maxsize=None)
+def compile_to_rows(
+    cls: Type[Any],
+    from_mapping: bool,
+) -> Callable[[Iterable[Any]], List[Dict[str, Any]]]:
+    """Generate the `to_rows` implementation of a model. The columns are spelled
+    out in the generated source, so there is no loop over the columns or lookup
+    of their keys for each record. Records are namedtuples whose fields start
+    with the columns, or mappings from attribute names if `from_mapping`."""
+    sparse = sparse_null_columns(cls) if cls.sparse_nulls else frozenset()
+    columns = list(column_keys(cls).items())
+
+    if not from_mapping and not sparse:
+        row = ", ".join(f"{key!r}: obj[{i}]" for i, (_, key) in enumerate(columns))
+        source = f"def to_rows(objs):\n    return [{{{row}}} for obj in objs]\n"
+    else:
+        lines = ["def to_rows(objs):", "    rows = []", "    for obj in objs:"]
+        lines.append("        row = {}")
+        for i, (attr, key) in enumerate(columns):
+            value = f"obj.get({attr!r}, MISSING)" if from_mapping else f"obj[{i}]"
+            conditions = []
+            if from_mapping:
+                conditions.append("value is not MISSING")
+            if key in sparse:
+                conditions.append("value is not None")
+            if conditions:
+                lines.append(f"        value = {value}")
+                lines.append(f"        if {' and '.join(conditions)}:")
+                lines.append(f"            row[{key!r}] = value")
+            else:
+                lines.append(f"        row[{key!r}] = {value}")
+        lines += ["        rows.append(row)", "    return rows"]
+        source = "\n".join(lines) + "\n"
+
+    namespace: Dict[str, Any] = {"MISSING": object()}
+    exec(compile(source, f"<{cls.__name__}.to_rows>", "exec"), namespace)
+    return namespace["to_rows"]
+
+
 # The record mixin class is more efficient than the MutableRecordMixin, so it
 # should be preferred. But the performance isn't from the mutability, it's
 # because we use namedtuples, which creates a new class on demand, which uses
@@ -285,6 +360,20 @@ class RecordMixin:
     # pyre-fixme[4]: Attribute must be annotated.
     _record = None
 
+    # All records of a class are instances of the same namedtuple, so they
+    # always have the same keys.
+    uniform_keys: bool = True
+
+    # Leave None values out of the rows passed to bulk inserts where that
+    # doesn't change what's stored (see `sparse_null_columns`), so statements
+    # bind fewer parameters. Worth it for classes with mostly unset columns.
+    sparse_nulls: bool = False
+
+    # Columns of a unique key that `merge` doesn't deduplicate on. Repeated rows
+    # with the same key are dropped from a batch before it is inserted, rather
+    # than failing the insert.
+    unique_key: Tuple[str, ...] = ()
+
     @classmethod
     # pyre-fixme[3]: Return type must be annotated.
     # pyre-fixme[2]: Parameter must be annotated.
@@ -294,19 +383,43 @@ class RecordMixin:
             if not extra_fields:
                 extra_fields = []
             mapper = inspect(cls)
-            keys = [c.key for c in mapper.column_attrs] + ["model"] + extra_fields
-            cls._record = namedtuple(cls.__name__ + "Record", keys)
+            keys = [c.key for c in mapper.column_attrs] + extra_fields
+            # `model` is the same for every record, so it lives on the class
+            # rather than taking up a field in each of them. Empty __slots__
+            # keeps the subclass as compact as the namedtuple.
+            cls._record = type(
+                cls.__name__ + "Record",
+                (namedtuple(cls.__name__ + "Record", keys),),
+                {"__slots__": (), "model": cls},
+            )
 
-        return cls._record(model=cls, **kwargs)
+        return cls._record(**kwargs)
 
     @classmethod
     # pyre-fixme[3]: Return type must be annotated.
     # pyre-fixme[2]: Parameter must be annotated.
     def to_dict(cls, obj):
-        return obj._asdict()
+        """Unused within sapp, which saves records with `to_rows`, but kept for
+        other callers. `model` is no longer a field of records, so it is added
+        back to keep the output the same."""
+        return dict(obj._asdict(), model=cls)
+
+    @classmethod
+    def to_rows(cls, objs: Iterable[Any]) -> List[Dict[str, Any]]:
+        """Table rows for records, keyed by column, ready for a bulk insert"""
+        return compile_to_rows(cls, from_mapping=False)(objs)
 
 
 class MutableRecordMixin:
+    # Records only contain the fields they were created with.
+    uniform_keys: bool = False
+
+    # See RecordMixin.sparse_nulls
+    sparse_nulls: bool = False
+
+    # See RecordMixin.unique_key
+    unique_key: Tuple[str, ...] = ()
+
     @classmethod
     # pyre-fixme[2]: Parameter must be annotated.
     def Record(cls, **kwargs) -> Munch:
@@ -316,8 +429,15 @@ class MutableRecordMixin:
     # pyre-fixme[3]: Return type must be annotated.
     # pyre-fixme[2]: Parameter must be annotated.
     def to_dict(cls, obj):
+        """Unused within sapp, see RecordMixin.to_dict"""
         return obj.toDict()
 
+    @classmethod
+    def to_rows(cls, objs: Iterable[Any]) -> List[Dict[str, Any]]:
+        """Table rows for records, keyed by column, ready for a bulk insert.
+        Fields that aren't columns are dropped."""
+        return compile_to_rows(cls, from_mapping=True)(objs)
+
 
 class PrimaryKeyBase(PrepareMixin, RecordMixin):  # noqa
     """Subclass this and include your declarative_base mixin"""
@@ -447,6 +567,21 @@ class PrimaryKeyGeneratorBase:  # pyre-ignore[13]
             session.commit()
             self.pks[cls.__name__] = pk_entry
 
+    def assign_range(self, cls: Type[Any], count: int) -> range:
+        """Take the next `count` ids for cls at once, see `get`"""
+        assert cls in self.QUERY_CLASSES, (
+            "%s primary key should be generated by SQLAlchemy" % cls.__name__
+        )
+        assert cls.__name__ in self.pks, (
+            "%s primary key needs to be initialized before use" % cls.__name__
+        )
+        (pk, max_pk) = self.pks[cls.__name__]
+        assert pk + count - 1 <= max_pk, (
+            "%s reserved primary key range exhausted" % cls.__name__
+        )
+        self.pks[cls.__name__] = (pk + count, max_pk)
+        return range(pk, pk + count)
+
     # pyre-fixme[2]: Parameter must be annotated.
     def get(self, cls) -> int:
         assert cls in self.QUERY_CLASSES, (
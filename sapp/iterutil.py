@@ -4,7 +4,7 @@
 # LICENSE file in the root directory of this source tree.
 
 import itertools
-from typing import Iterable, Iterator, List, TypeVar
+from typing import Callable, Iterable, Iterator, List, TypeVar, Union
 
 T = TypeVar("T")
 
@@ -22,3 +22,26 @@ def split_every(n: int, iterable: Iterable[T]) -> Iterator[List[T]]:
     while piece:
         yield piece
         piece = list(itertools.islice(i, n))
+
+
+def drain_every(
+    size: Union[int, Callable[[], int]], items: List[T]
+) -> Iterator[List[T]]:
+    """Like split_every, but removes each batch from 'items' before yielding it,
+    so batches that have been dealt with can be garbage collected:
+
+    list(drain_every(2, list(range(5)))) => [[0, 1], [2, 3], [4]]
+
+    'size' can also be a function, which is called for the size of each batch.
+    """
+    next_size = size if callable(size) else lambda: size
+    # Deleting from the end of a list is cheap, deleting from the front is not
+    items.reverse()
+    while items:
+        n = next_size()
+        if n <= 0:
+            raise ValueError(f"Cannot split into size {n}")
+        piece = items[-n:]
+        del items[-n:]
+        piece.reverse()
+        yield piece
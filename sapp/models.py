@@ -430,6 +430,10 @@ class IssueInstance(Base, PrepareMixin, MutableRecordMixin):
         Index("ix_issue_instances_run_id_purge_status", "run_id", "purge_status"),
     ) + BASE_TABLE_ARGS
 
+    # fix_info_id and the min_trace_length_* columns stay None for issues
+    # without fix info or without traces
+    sparse_nulls = True
+
     # pyre-fixme[8]: Attribute has type `DBID`; used as `Column[typing.Any]`.
     id: DBID = Column(BIGDBIDType, primary_key=True)
 
@@ -1329,6 +1333,10 @@ class TraceFrameAnnotation(Base, PrepareMixin, RecordMixin):
     __tablename__ = "trace_frame_annotations"
     __table_args__ = BASE_TABLE_ARGS
 
+    # Annotations generated for features leave kind, leaf_id, link and
+    # trace_key None
+    sparse_nulls = True
+
     # pyre-fixme[8]: Attribute has type `DBID`; used as `Column[typing.Any]`.
     id: DBID = Column(BIGDBIDType, nullable=False, primary_key=True)
 
@@ -1607,6 +1615,8 @@ class ClassTypeInterval(Base, PrepareMixin, RecordMixin):
         Index("ix_class_type_intervals_bounds", "run_id", "lower_bound", "upper_bound"),
     ) + BASE_TABLE_ARGS
 
+    unique_key = ("run_id", "class_name")
+
     # Synthetic primary key allows easier pagination when compared to
     # using (run_id, class_name) as a composite primary key
     id = Column("id", BIGDBIDType, nullable=False, primary_key=True)
@@ -1626,6 +1636,8 @@ class MetaRunIssueInstanceIndex(Base, PrepareMixin, RecordMixin):
         Index("ix_metarun_issue_instance_index", "meta_run_id", "issue_instance_hash"),
     ) + BASE_TABLE_ARGS
 
+    unique_key = ("issue_instance_id",)
+
     issue_instance_id = Column(BIGDBIDType, nullable=False, primary_key=True)
     meta_run_id = Column(BIGDBIDType, nullable=False)
     issue_instance_hash: Column[str] = Column(
@@ -6,6 +6,7 @@
 from unittest import TestCase
 
 from ..db_support import DBID
+from ..models import TraceFrameLeafAssoc
 
 
 class DBSupportTest(TestCase):
@@ -36,3 +37,25 @@ class DBSupportTest(TestCase):
     def test_dbid_resolved_to_none(self) -> None:
         primary_key = DBID()
         self.assertEqual(None, primary_key.resolved())
+
+    def test_record_slots(self) -> None:
+        record = TraceFrameLeafAssoc.Record(
+            trace_frame_id=DBID(1), leaf_id=DBID(2), trace_length=None
+        )
+        self.assertIs(record.model, TraceFrameLeafAssoc)
+        self.assertFalse(hasattr(record, "__dict__"))
+        self.assertNotIn("model", record._fields)
+
+    def test_record_to_dict(self) -> None:
+        record = TraceFrameLeafAssoc.Record(
+            trace_frame_id=DBID(1), leaf_id=DBID(2), trace_length=None
+        )
+        self.assertEqual(
+            TraceFrameLeafAssoc.to_dict(record),
+            {
+                "trace_frame_id": record.trace_frame_id,
+                "leaf_id": record.leaf_id,
+                "trace_length": None,
+                "model": TraceFrameLeafAssoc,
+            },
+        )
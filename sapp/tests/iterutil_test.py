@@ -5,7 +5,7 @@
 
 from unittest import TestCase
 
-from ..iterutil import split_every
+from ..iterutil import drain_every, split_every
 
 
 class UtilsTest(TestCase):
@@ -13,3 +13,18 @@ class UtilsTest(TestCase):
         self.assertEqual(
             list(split_every(2, range(10))), [[0, 1], [2, 3], [4, 5], [6, 7], [8, 9]]
         )
+
+    def test_drain_every(self) -> None:
+        items = list(range(5))
+        batches = drain_every(2, items)
+        self.assertEqual(next(batches), [0, 1])
+        self.assertEqual(items, [4, 3, 2])
+        self.assertEqual(list(batches), [[2, 3], [4]])
+        self.assertEqual(items, [])
+
+    def test_drain_every_varying_size(self) -> None:
+        sizes = iter([1, 3, 2])
+        self.assertEqual(
+            list(drain_every(lambda: next(sizes), list(range(5)))),
+            [[0], [1, 2, 3], [4]],
+        )